@@ -5,8 +5,8 @@ from pathlib import Path
 BASE_DIR: Path = Path(__file__).resolve().parent
 
 class DB:
-    def __init__(self):
-        self.con = sqlite3.connect(BASE_DIR / "machines.db")
+    def __init__(self, db_path: Path | None = None):
+        self.con = sqlite3.connect(db_path or BASE_DIR / "machines.db")
         self.cur = self.con.cursor()
     
     def init_db(self):
@@ -22,10 +22,6 @@ class DB:
         )
         self.con.commit()
     
-    def get_machine_id(self, machine: MachineData) -> int:
-        res = self.cur.execute("SELECT machine_id FROM machines WHERE machine_number = ?", (machine.machine_number,))
-        return res.fetchone()[0]
-
     def get_machine_by_machine_number(self, machine_number: int) -> MachineData|None:
         res = self.cur.execute("SELECT machine_number, supported_diameter, supported_abutment, ending_machine_code FROM machines WHERE machine_number = ?", (machine_number, )).fetchone()
         if not res:
@@ -51,25 +47,44 @@ class DB:
         ))
 
     def update_machine(self, machine: MachineData) -> None:
-        machine_id: int = self.get_machine_id(machine)
         self.cur.execute((
             "UPDATE machines SET "
-            "machine_number = ?,"
             "supported_diameter = ?,"
             "supported_abutment = ?,"
-            "ending_machine_code = ?"
+            "ending_machine_code = ? "
             "WHERE "
-                "machine_id = ?"),
+                "machine_number = ?"),
             (
-                machine.machine_number,
                 machine.supported_diameter.value,
                 machine.supported_abutment.value,
                 machine.ending_machine_code,
-                machine_id,
+                machine.machine_number,
             )
         )
     
     def delete_machine(self, machine: MachineData) -> None:
-        machine_id: int = self.get_machine_id(machine)
-        self.cur.execute(("DELETE FROM machines WHERE machine_id = ?"), (machine_id,))
-    
\ No newline at end of file
+        self.cur.execute(("DELETE FROM machines WHERE machine_number = ?"), (machine.machine_number,))
+
+    def get_next_machine_number(self) -> int:
+        res = self.cur.execute("SELECT COALESCE(MAX(machine_number), 0) FROM machines").fetchone()
+        return res[0] + 1
+
+    def upsert_machines(self, machines: list[MachineData]) -> None:
+        with self.con:
+            self.cur.executemany((
+                "INSERT INTO machines (machine_number, supported_diameter, supported_abutment, ending_machine_code) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(machine_number) DO UPDATE SET "
+                    "supported_diameter = excluded.supported_diameter,"
+                    "supported_abutment = excluded.supported_abutment,"
+                    "ending_machine_code = excluded.ending_machine_code"),
+                [
+                    (
+                        machine.machine_number,
+                        machine.supported_diameter.value,
+                        machine.supported_abutment.value,
+                        machine.ending_machine_code,
+                    )
+                    for machine in machines
+                ]
+            )
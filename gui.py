@@ -2,40 +2,31 @@ import tkinter as tk
 import re
 import os
 import time
-import shutil
 import subprocess
 import threading
 from pathlib import Path
 from tkinter import ttk
 from tkinter import filedialog, messagebox
-from datetime import datetime, timedelta, date
 
 from db_util import DB
+from machine_index import MachineIndex
+from machine_io import MachineImportError, read_machines, write_machines
 from machine_data import MachineData, AbutmentType, Diameter
+from nc_index import NCIndex
+from pipeline import (
+    LINE_REGEX,
+    OutputPlan,
+    execute_plan,
+    get_previous_workday_all_nc_path,
+    parse_job_lines,
+    plan_output,
+)
+from scheduler import balance_jobs, format_load_report, get_machine_loads
 
 BASE_DIR: Path = Path(__file__).resolve().parent
-ERP_DIR: Path = Path(r"\\192.168.1.100\Trubox\####ERP_RM####")
 OUTPUT_DIR: Path = Path("output")
 
 
-def date_as_path(date: date | None = None) -> Path:
-    if date is None:
-        date = datetime.now().date()
-    _day: str = f"D{'0' + str(date.day) if date.day < 10 else str(date.day)}"
-    _month: str = f"M{'0' + str(date.month) if date.month < 10 else str(date.month)}"
-    _year: str = f"Y{str(date.year)}"
-    return Path(_year, _month, _day)
-
-
-def get_previous_workday_all_nc_path() -> Path:
-    current_date: date = datetime.now().date()
-    previous_date: date = current_date - timedelta(days=1)
-    if datetime.weekday(current_date) == 0:
-        previous_date = current_date - timedelta(days=3)
-
-    return ERP_DIR / date_as_path(previous_date) / Path("1. CAM/3. NC files/ALL")
-
-
 class LoadingDialog(tk.Toplevel):
     def __init__(self, parent, **kwargs) -> None:
         super().__init__(parent, **kwargs)
@@ -86,9 +77,8 @@ class CNCFormatter(tk.Frame):
 
         self.parent = parent
         self.db: DB = db
-        self.line_regex: re.Pattern = re.compile(
-            r"(?P<machine>[0-9]{2})_[0-9]{1}_[0-9]{3}\s+(?P<pg_id>[0-9]{4})(?![0-9a-zA-Z])"
-        )
+        self.line_regex: re.Pattern = LINE_REGEX
+        self.nc_index: NCIndex = NCIndex(BASE_DIR / "nc_index.json")
 
         self.cnc_data_label: tk.Label = tk.Label(
             self, text="Paste Data Below", font="Arial 11 bold"
@@ -107,8 +97,15 @@ class CNCFormatter(tk.Frame):
             text="Select PRG Folder",
             command=self.select_nc_file_folder,
         )
+        self.balance_jobs: tk.BooleanVar = tk.BooleanVar(self, value=False)
+        self.balance_jobs_checkbox: ttk.Checkbutton = ttk.Checkbutton(
+            self.folder_selection_frame,
+            text="Balance across compatible machines",
+            variable=self.balance_jobs,
+        )
         self.prg_folder_path_entry.grid(row=2, column=0, sticky="nswe")
         self.add_files_btn.grid(row=2, column=1)
+        self.balance_jobs_checkbox.grid(row=3, column=0, columnspan=2, sticky="w")
 
         self.cnc_data_textarea: tk.Text = tk.Text(self)
         self.cnc_data_textarea.tag_configure(
@@ -126,13 +123,22 @@ class CNCFormatter(tk.Frame):
         )
         self.cnc_data_textarea["yscrollcommand"] = self.y_scroll.set
 
+        self.button_frame: tk.Frame = tk.Frame(self)
+        self.button_frame.grid_columnconfigure(0, weight=1)
         self.cnc_process_data_btn: tk.Button = tk.Button(
-            self,
+            self.button_frame,
             text="Process",
             background="#47c9a4",
             foreground="#000000",
             command=self.begin_processing,
         )
+        self.plan_only_btn: tk.Button = tk.Button(
+            self.button_frame,
+            text="Plan Only",
+            command=lambda: self.begin_processing(plan_only=True),
+        )
+        self.cnc_process_data_btn.grid(row=0, column=0, sticky="we")
+        self.plan_only_btn.grid(row=0, column=1, sticky="we", padx=(5, 0))
 
         self.columnconfigure(0, weight=1)
         self.rowconfigure(1, weight=1)
@@ -143,7 +149,7 @@ class CNCFormatter(tk.Frame):
         )
         self.y_scroll.grid(row=1, column=1, sticky="ns")
         self.folder_selection_frame.grid(row=2, columnspan=2, sticky="nsew", padx=5)
-        self.cnc_process_data_btn.grid(
+        self.button_frame.grid(
             row=3, column=0, sticky="we", padx=5, pady=5, columnspan=2
         )
 
@@ -158,152 +164,103 @@ class CNCFormatter(tk.Frame):
         )
         self.nc_file_path.set(nc_file_path)
 
-    def begin_processing(self) -> None:
+    def begin_processing(self, plan_only: bool = False) -> None:
         self.parent.config(cursor="watch")
         self.cnc_process_data_btn.config(state=tk.DISABLED, text="Processing...")
-        process_text_thread = threading.Thread(target=self.process_text, daemon=True)
+        self.plan_only_btn.config(state=tk.DISABLED)
+        process_text_thread = threading.Thread(
+            target=self.process_text, args=(plan_only,), daemon=True
+        )
         process_text_thread.start()
 
     def done_processing_callback(self) -> None:
         self.parent.config(cursor="")
         self.cnc_process_data_btn.config(state=tk.NORMAL, text="Process")
+        self.plan_only_btn.config(state=tk.NORMAL)
 
-    def process_text(self) -> None:
+    def process_text(self, plan_only: bool = False) -> None:
         try:
-            if not OUTPUT_DIR.exists():
-                OUTPUT_DIR.mkdir()
-
             db: DB = DB()
             db.init_db()
 
-            for file in OUTPUT_DIR.iterdir():
-                if file.is_dir() and file.exists():
-                    shutil.rmtree(file)
-
             lines: list[str] = self.cnc_data_textarea.get("1.0", "end").splitlines()
-            machines: dict[str, list[str]] = dict()
-            for i, line in enumerate(lines):
-                if not self.is_valid(line):
+            machines, invalid_lines = parse_job_lines(lines)
+            for i in range(len(lines)):
+                if i + 1 in invalid_lines:
                     self.insert_error(i + 1)
                     self.done_processing_callback()
                     return
 
                 self.remove_error(i + 1)
-                line_regex: re.Match | None = self.line_regex.match(line)
-                if line_regex:
-                    machine_number: str = line_regex.group("machine")
-                    pg_id: str = line_regex.group("pg_id")
-                    if not machines.get(machine_number):
-                        machines[machine_number] = list([pg_id])
-                    else:
-                        if pg_id not in machines[machine_number]:
-                            machines[machine_number].append(pg_id)
-
-            self.cnc_data_textarea.delete("1.0", "end")
 
             if len(machines.keys()) == 0:
                 self.done_processing_callback()
                 return
 
+            original_machines: dict[str, list[str]] = machines
+            if self.balance_jobs.get():
+                machines = balance_jobs(machines, db.get_all_machines())
+            machine_loads = get_machine_loads(machines, original_machines)
+
+            plan: OutputPlan = plan_output(
+                machines, db, Path(self.nc_file_path.get()), self.nc_index
+            )
+            self.nc_index.save()
+            if plan_only:
+                self.done_processing_callback()
+                report: list[str] = [plan.describe(), plan.describe_machines()]
+                if plan.has_problems():
+                    report.append(plan.describe_problems())
+                if self.balance_jobs.get() or any(load.file_count > 1 for load in machine_loads):
+                    report.append(format_load_report(machine_loads))
+                messagebox.showinfo("Plan", "\n\n".join(report))
+                return
+
+            if plan.has_problems():
+                if not messagebox.askyesno(
+                    "Problems Found",
+                    (
+                        f"{plan.describe_problems()}\n\n"
+                        "These programs will be left out of the machine programs. "
+                        f"Continue?\n\n{plan.describe()}"
+                    ),
+                ):
+                    self.done_processing_callback()
+                    return
+
+            if len(plan.machines) == 0:
+                self.done_processing_callback()
+                return
+
             loading_dialog: LoadingDialog = LoadingDialog(self.parent)
-            loading_dialog.withdraw()
-            max_value: float = len(machines.keys()) * 10
-            loading_dialog.set_loading_max(max_value)
+            loading_dialog.set_loading_max(plan.file_count)
+            loading_dialog.set_status_text(plan.describe())
 
-            increment_by: float = loading_dialog.maximum / len(machines.keys()) / 2
+            def on_progress(text: str) -> None:
+                loading_dialog.set_status_text(text)
+                loading_dialog.increment_progress_value(1)
 
-            for machine, prg_ids in machines.items():
-                if not db.get_machine_by_machine_number(int(machine)):
-                    messagebox.showerror("Missing Machine Settings", f"No machine settings for Machine {machine}")
-                self.create_machine_folder(
-                    machine, list(prg_ids), db, loading_dialog, increment_by
-                )
-            if len(list(OUTPUT_DIR.iterdir())) > 0:
-                self.open_output_folder()
+            try:
+                execute_plan(plan, OUTPUT_DIR, on_progress)
+            finally:
+                loading_dialog.destroy()
+
+            self.cnc_data_textarea.delete("1.0", "end")
+            self.open_output_folder()
             self.done_processing_callback()
-            loading_dialog.destroy()
+            summary: str = plan.describe_machines()
+            if self.balance_jobs.get() or any(load.file_count > 1 for load in machine_loads):
+                summary += f"\n\n{format_load_report(machine_loads)}"
+            messagebox.showinfo("Summary", summary)
         except PermissionError as e:
             messagebox.showwarning("Warning","A file is open in another process. Close it first to continue.")
             self.done_processing_callback()
             return
-
-    def create_machine_folder(
-        self,
-        machine: str,
-        pg_ids: list[str],
-        db: DB,
-        loading_dialog: LoadingDialog,
-        increment_by: float,
-    ) -> None:
-        loading_dialog.deiconify()
-        machine_data = db.get_machine_by_machine_number(int(machine))
-
-        if not machine_data:
+        except OSError as e:
+            messagebox.showerror("Error", f"Processing failed, nothing was written.\n\n{e}")
+            self.done_processing_callback()
             return
 
-        machine_folder_name: list[str] = [f"Machine {machine}"]
-        match machine_data.supported_diameter:
-            case Diameter.PI10:
-                machine_folder_name.append("Ø10")
-            case Diameter.PI14:
-                machine_folder_name.append("Ø14")
-
-        match machine_data.supported_abutment:
-            case AbutmentType.ASC:
-                machine_folder_name.append("ASC")
-            case AbutmentType.AOT_AND_TLOC:
-                machine_folder_name.append("AOT&T-L")
-            case AbutmentType.AOT_PLUS:
-                machine_folder_name.append("AOT PLUS")
-
-        machine_folder: Path = OUTPUT_DIR / " - ".join(machine_folder_name)
-        loading_dialog.set_status_text(f"Creating folder {machine_folder.name}")
-        loading_dialog.increment_progress_value(increment_by)
-        time.sleep(0.1)
-        machine_folder.mkdir(exist_ok=True)
-
-        machine_file_path: Path = machine_folder / f"{int(machine)}.prg"
-        machine_file_path.touch()
-
-        header: str = f"O{int(machine)}(FOR INPUT           )\n$1\n"
-        with machine_file_path.open("w+") as file:
-            file.write(header)
-            num: int = 501
-            while num < 506:
-                file.write(f"#{num}=\nG4 U0.5\n")
-                num += 1
-
-            loading_dialog.set_status_text(f"Copying files to {machine_folder.name}")
-            loading_dialog.increment_progress_value(increment_by)
-
-            for pg_id in pg_ids:
-                file.write(f"#{num}={pg_id}\nG4 U0.5\n")
-                num += 1
-                if (Path(self.nc_file_path.get()) / f"{pg_id}.prg").resolve().exists():
-                    shutil.copy2(
-                        (Path(self.nc_file_path.get()) / f"{pg_id}.prg").resolve(),
-                        (machine_folder / f"{pg_id}.prg").resolve(),
-                    )
-
-            while num < 600:
-                file.write(f"#{num}=\nG4 U0.5\n")
-                num += 1
-
-            file.write(("\nM2\nM99\n\n\n$2\n\nM2\nM99\n\n"))
-
-            file.write(machine_data.ending_machine_code)
-
-    def is_valid(self, line_text: str) -> bool:
-        if re.match(r"\s+[\n]?", line_text) or line_text == "":
-            return True
-
-        line_regex: re.Match | None = self.line_regex.match(line_text)
-
-        if not line_regex:
-            return False
-
-        return True
-
     def insert_error(self, line_index: int) -> None:
         line_count: tuple[int] | None = self.cnc_data_textarea.count(
             "1.0", "end", "lines"
@@ -528,23 +485,46 @@ class MachineSettings(tk.Frame):
 
 
 class MachineTab(tk.Frame):
+    LISTBOX_CHUNK_SIZE: int = 50
+
     def __init__(self, parent, db: DB, **kwargs) -> None:
         super().__init__(parent, **kwargs)
 
         self.db: DB = db
+        self.machine_index: MachineIndex = MachineIndex(self.db.get_all_machines())
+        self.visible_machines: list[int] = []
+        self.render_job: str | None = None
 
         self.add_machine_btn: tk.Button = tk.Button(
             self, text="+ Add Machine", command=self.add_machine
         )
+        self.search_text: tk.StringVar = tk.StringVar(self, value="")
+        self.search_text.trace_add("write", self.on_search)
+        self.search_entry: ttk.Entry = ttk.Entry(
+            self, width=10, textvariable=self.search_text
+        )
         self.listbox = tk.Listbox(self, width=10, exportselection=False)
         self.machine_settings = MachineSettings(self, db)
 
+        self.import_export_frame: tk.Frame = tk.Frame(self)
+        self.import_export_frame.grid_columnconfigure((0, 1), weight=1)
+        self.import_btn: tk.Button = tk.Button(
+            self.import_export_frame, text="Import", command=self.import_machines
+        )
+        self.export_btn: tk.Button = tk.Button(
+            self.import_export_frame, text="Export", command=self.export_machines
+        )
+        self.import_btn.grid(row=0, column=0, sticky="we")
+        self.export_btn.grid(row=0, column=1, sticky="we")
+
         self.grid_columnconfigure(1, weight=1)
-        self.grid_rowconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=1)
 
         self.add_machine_btn.grid(row=0, column=0, sticky="nsew")
-        self.listbox.grid(row=1, column=0, sticky="nsew")
-        self.machine_settings.grid(row=0, column=1, rowspan=2, sticky="nsew")
+        self.search_entry.grid(row=1, column=0, sticky="nsew")
+        self.listbox.grid(row=2, column=0, sticky="nsew")
+        self.import_export_frame.grid(row=3, column=0, sticky="nsew")
+        self.machine_settings.grid(row=0, column=1, rowspan=4, sticky="nsew")
 
         self.listbox.bind("<<ListboxSelect>>", self.on_listbox_select)
         self.listbox.bind("<Button-1>", self.on_listbox_click)
@@ -564,39 +544,111 @@ class MachineTab(tk.Frame):
             self.listbox.activate(self.listbox.curselection())
 
     def on_listbox_select(self, event) -> None:
-        if self.listbox.curselection():
-            selected_item: str = self.listbox.get(self.listbox.curselection())
-            machine_number: int = int(selected_item.split(" ")[1])
-            machine_data: MachineData | None = self.db.get_machine_by_machine_number(
-                machine_number
-            )
-            if machine_data:
-                self.machine_settings.populate(machine_data)
+        machine_number: int | None = self.get_selected_machine_number()
+        if machine_number is None:
+            return
+
+        machine_data: MachineData | None = self.machine_index.get(machine_number)
+        if machine_data:
+            self.machine_settings.populate(machine_data)
+
+    def on_search(self, *args) -> None:
+        self.populate_machine_listbox()
+
+    def get_selected_machine_number(self) -> int | None:
+        current_selection = self.listbox.curselection()
+        if not current_selection or current_selection[0] >= len(self.visible_machines):
+            return None
+        return self.visible_machines[current_selection[0]]
 
     def populate_machine_listbox(self) -> None:
-        machines: list[MachineData] = self.db.get_all_machines()
-        for machine in machines:
-            self.listbox.insert(tk.END, f"Machine {machine.machine_number}")
-        if len(machines) > 0:
+        if self.render_job is not None:
+            self.after_cancel(self.render_job)
+            self.render_job = None
+
+        self.listbox.delete(0, tk.END)
+        self.visible_machines = self.machine_index.search(self.search_text.get())
+        self.render_rows(0)
+
+        if len(self.visible_machines) > 0:
             self.listbox.selection_set(0)
-            self.machine_settings.populate(machines[0])
+            machine_data: MachineData | None = self.machine_index.get(self.visible_machines[0])
+            if machine_data:
+                self.machine_settings.populate(machine_data)
+
+    def render_rows(self, start: int) -> None:
+        """Insert the next chunk of rows and schedule the rest.
+
+        Only the first chunk is drawn straight away; the remainder is added
+        from the event loop so typing in the search box never blocks.
+        """
+        end: int = min(start + self.LISTBOX_CHUNK_SIZE, len(self.visible_machines))
+        self.listbox.insert(
+            tk.END,
+            *[f"Machine {number}" for number in self.visible_machines[start:end]],
+        )
+
+        if end < len(self.visible_machines):
+            self.render_job = self.after(1, self.render_rows, end)
+        else:
+            self.render_job = None
 
     def add_machine(self) -> None:
-        machine_count: int = len(self.db.get_all_machines())
-        self.db.add_machine(
-            MachineData(machine_count + 1, Diameter.PI10, AbutmentType.DS, "")
+        machine_number: int = self.db.get_next_machine_number()
+        machine_data: MachineData = MachineData(
+            machine_number, Diameter.PI10, AbutmentType.DS, ""
         )
-        self.listbox.insert("end", f"Machine {machine_count + 1}")
+        self.db.add_machine(machine_data)
         self.db.con.commit()
+        self.machine_index.put(machine_data)
 
-    def update_machine(self, event) -> None:
-        current_selection = self.listbox.curselection()
+        if self.search_text.get():
+            self.search_text.set("")
+            return
+
+        self.visible_machines.append(machine_number)
+        if self.render_job is None:
+            self.listbox.insert("end", f"Machine {machine_number}")
+
+    def import_machines(self) -> None:
+        file_path: str = filedialog.askopenfilename(
+            filetypes=[("Machine Settings", "*.csv *.json"), ("All Files", "*.*")]
+        )
+        if not file_path:
+            return
+
+        try:
+            machines: list[MachineData] = read_machines(Path(file_path))
+        except (MachineImportError, OSError) as e:
+            messagebox.showerror("Import Failed", str(e))
+            return
 
-        if not current_selection:
+        self.db.upsert_machines(machines)
+        self.machine_index.load(self.db.get_all_machines())
+        self.populate_machine_listbox()
+        messagebox.showinfo("Import Complete", f"Imported {len(machines)} machines")
+
+    def export_machines(self) -> None:
+        file_path: str = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON", "*.json")],
+        )
+        if not file_path:
             return
 
-        selected_item: str = self.listbox.get(current_selection)
-        machine_number: int = int(selected_item.split(" ")[1])
+        try:
+            write_machines(
+                Path(file_path),
+                [self.machine_index.machines[number] for number in self.machine_index.numbers],
+            )
+        except (MachineImportError, OSError) as e:
+            messagebox.showerror("Export Failed", str(e))
+
+    def update_machine(self, event) -> None:
+        machine_number: int | None = self.get_selected_machine_number()
+
+        if machine_number is None:
+            return
 
         diameter: Diameter = Diameter.PI10
         abutment_type: AbutmentType = AbutmentType.DS
@@ -624,22 +676,27 @@ class MachineTab(tk.Frame):
         )
         self.db.update_machine(machine_data)
         self.db.con.commit()
+        self.machine_index.put(machine_data)
 
     def delete_machine(self, event=None) -> None:
         current_selection = self.listbox.curselection()
+        machine_number: int | None = self.get_selected_machine_number()
 
-        if not current_selection:
+        if machine_number is None:
             return
 
-        selected_item: str = self.listbox.get(current_selection)
-        machine_number: int = int(selected_item.split(" ")[1])
-        machine_data: MachineData | None = self.db.get_machine_by_machine_number(
-            machine_number
-        )
+        machine_data: MachineData | None = self.machine_index.get(machine_number)
         if machine_data:
             self.db.delete_machine(machine_data)
-            self.listbox.delete(current_selection)
             self.db.con.commit()
+            self.machine_index.remove(machine_number)
+            if self.render_job is not None:
+                # A pending render_rows call holds an index into
+                # visible_machines, so start the list over instead.
+                self.populate_machine_listbox()
+                return
+            self.visible_machines.remove(machine_number)
+            self.listbox.delete(current_selection)
 
     def on_listbox_right_click(self, event) -> None:
         if self.listbox.get(0, "end"):
@@ -0,0 +1,398 @@
+import argparse
+import json
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote
+
+from db_util import BASE_DIR, DB
+from nc_index import NCIndex
+from pipeline import (
+    ERP_DIR,
+    PG_ID_REGEX,
+    NCFileCache,
+    OutputPlan,
+    execute_plan,
+    get_previous_workday_all_nc_path,
+    parse_job_lines,
+    plan_output,
+)
+from scheduler import balance_jobs, get_machine_loads
+
+DEFAULT_HOST: str = "127.0.0.1"
+DEFAULT_PORT: int = 8765
+DEFAULT_WORKERS: int = 4
+MAX_REQUEST_BYTES: int = 1024 * 1024
+# Kept outside the GUI's output folder, which is replaced on every GUI run.
+SERVICE_DIR: Path = BASE_DIR / "job_service"
+DEFAULT_RETENTION: timedelta = timedelta(days=1)
+
+
+@dataclass
+class Job:
+    id: str
+    jobs: dict[str, list[str]]
+    nc_dir: Path
+    balance: bool = False
+    strict: bool = False
+    status: str = "queued"
+    created: str = field(default_factory=lambda: datetime.now().isoformat(timespec="seconds"))
+    started: str | None = None
+    finished: str | None = None
+    plan: str | None = None
+    problems: list[str] = field(default_factory=list)
+    summary: list[str] = field(default_factory=list)
+    loads: list[dict] = field(default_factory=list)
+    files: list[str] = field(default_factory=list)
+    error: str | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "nc_dir": str(self.nc_dir),
+            "balance": self.balance,
+            "strict": self.strict,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "plan": self.plan,
+            "problems": self.problems,
+            "summary": self.summary,
+            "loads": self.loads,
+            "files": self.files,
+            "error": self.error,
+        }
+
+
+class JobService:
+    """Queue of formatting jobs run on a shared worker pool.
+
+    Every job reads the same machines.db, validates programs against one
+    NCIndex and copies NC files through one NCFileCache, so programs
+    requested by several workstations are only pulled from the ERP share
+    once. Each job writes to its own folder under output_dir; finished jobs
+    and their folders are removed once they are older than retention. A job
+    may only pick its own NC folder if it is inside nc_root.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        cache_dir: Path,
+        db_path: Path | None = None,
+        nc_dir: Path | None = None,
+        workers: int = DEFAULT_WORKERS,
+        retention: timedelta = DEFAULT_RETENTION,
+        nc_root: Path | None = None,
+    ) -> None:
+        self.output_dir: Path = Path(output_dir).resolve()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path: Path | None = db_path
+        self.nc_dir: Path | None = nc_dir
+        self.nc_root: Path | None = Path(nc_root).resolve() if nc_root else None
+        self.cache: NCFileCache = NCFileCache(cache_dir)
+        self.nc_index: NCIndex = NCIndex(Path(cache_dir) / "nc_index.json")
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers)
+        self.retention: timedelta = retention
+        self.jobs: dict[str, Job] = dict()
+        self.lock: threading.Lock = threading.Lock()
+        self.prune_jobs()
+
+    def submit(
+        self,
+        jobs: dict[str, list[str]],
+        nc_dir: Path | None = None,
+        balance: bool = False,
+        strict: bool = False,
+    ) -> Job:
+        job: Job = Job(
+            uuid.uuid4().hex[:12],
+            jobs,
+            Path(nc_dir or self.nc_dir or get_previous_workday_all_nc_path()),
+            balance,
+            strict,
+        )
+        self.prune_jobs()
+        with self.lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job)
+        return job
+
+    def resolve_nc_dir(self, nc_dir: str) -> Path:
+        """Resolve an NC folder requested by a client, relative to nc_root.
+
+        Raises ValueError for folders outside nc_root, so clients can't make
+        the service read and serve back files from anywhere it can reach.
+        """
+        if not self.nc_root:
+            raise ValueError("This service does not accept 'nc_dir'")
+        path: Path = (self.nc_root / nc_dir).resolve()
+        if not path.is_relative_to(self.nc_root):
+            raise ValueError(f"'nc_dir' must be inside {self.nc_root}")
+        return path
+
+    def prune_jobs(self) -> None:
+        """Forget finished jobs older than retention and delete their output.
+
+        Folders in output_dir that belong to no known job (e.g. from before a
+        restart) are removed once they are older than retention too.
+        """
+        cutoff: datetime = datetime.now() - self.retention
+        with self.lock:
+            expired: list[Job] = [
+                job for job in self.jobs.values()
+                if job.finished and datetime.fromisoformat(job.finished) < cutoff
+            ]
+            for job in expired:
+                del self.jobs[job.id]
+            known: set[str] = set(self.jobs)
+
+        for job in expired:
+            shutil.rmtree(self.job_dir(job), ignore_errors=True)
+
+        for path in self.output_dir.iterdir():
+            if path.name in known or not path.is_dir():
+                continue
+            if datetime.fromtimestamp(path.stat().st_mtime) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def all_jobs(self) -> list[Job]:
+        with self.lock:
+            return list(self.jobs.values())
+
+    def job_dir(self, job: Job) -> Path:
+        return self.output_dir / job.id
+
+    def run(self, job: Job) -> None:
+        job.status = "running"
+        job.started = datetime.now().isoformat(timespec="seconds")
+        db: DB | None = None
+        try:
+            # sqlite connections can't be shared across threads, so each job
+            # opens its own connection to the shared machines.db.
+            db = DB(self.db_path)
+            db.init_db()
+
+            jobs: dict[str, list[str]] = job.jobs
+            if job.balance:
+                jobs = balance_jobs(jobs, db.get_all_machines())
+            job.loads = [asdict(load) for load in get_machine_loads(jobs, job.jobs)]
+
+            plan: OutputPlan = plan_output(jobs, db, job.nc_dir, self.nc_index)
+            self.nc_index.save()
+            job.plan = plan.describe()
+            job.problems = plan.describe_problems().splitlines()
+            job.summary = plan.describe_machines().splitlines()
+            if job.strict and plan.has_problems():
+                raise ValueError("Plan has problems and the job is strict")
+
+            execute_plan(plan, self.job_dir(job), fetch=self.cache.fetch)
+            job.files = sorted(
+                path.relative_to(self.job_dir(job)).as_posix()
+                for path in self.job_dir(job).rglob("*")
+                if path.is_file()
+            )
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            if db:
+                db.con.close()
+            job.finished = datetime.now().isoformat(timespec="seconds")
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """HTTP API for JobService.
+
+    POST /jobs                 submit {"lines": [...]} or {"jobs": {"05": ["1234"]}},
+                               optionally with "nc_dir" (inside the NC root) and
+                               the booleans "balance" and "strict"
+    GET  /jobs                 list jobs
+    GET  /jobs/<id>            job status, plan, problems, summary and machine loads
+    GET  /jobs/<id>/files/...  download a generated file
+    GET  /cache                NC file cache hit/miss counts
+    """
+
+    service: JobService
+
+    def do_GET(self) -> None:
+        parts: list[str] = [part for part in self.path.split("?")[0].split("/") if part]
+
+        match parts:
+            case ["jobs"]:
+                self.send_json([job.to_dict() for job in self.service.all_jobs()])
+            case ["jobs", job_id]:
+                job: Job | None = self.service.get(job_id)
+                if not job:
+                    self.send_error(HTTPStatus.NOT_FOUND, "Unknown job")
+                    return
+                self.send_json(job.to_dict())
+            case ["jobs", job_id, "files", *file_parts]:
+                self.send_job_file(job_id, file_parts)
+            case ["cache"]:
+                self.send_json({"hits": self.service.cache.hits, "misses": self.service.cache.misses})
+            case _:
+                self.send_error(HTTPStatus.NOT_FOUND)
+
+    def do_POST(self) -> None:
+        if self.path.split("?")[0].rstrip("/") != "/jobs":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        try:
+            length: int = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            self.send_json({"error": "Invalid Content-Length"}, HTTPStatus.BAD_REQUEST)
+            return
+        if length > MAX_REQUEST_BYTES:
+            self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+
+        try:
+            body: dict = json.loads(self.rfile.read(length) or b"{}")
+            jobs: dict[str, list[str]] = self.parse_jobs(body)
+            nc_dir: Path | None = None
+            if body.get("nc_dir") is not None:
+                if not isinstance(body["nc_dir"], str):
+                    raise ValueError("'nc_dir' must be a string")
+                nc_dir = self.service.resolve_nc_dir(body["nc_dir"])
+            balance: bool = self.parse_flag(body, "balance")
+            strict: bool = self.parse_flag(body, "strict")
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_json({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+            return
+
+        job: Job = self.service.submit(jobs, nc_dir, balance, strict)
+        self.send_json(job.to_dict(), HTTPStatus.ACCEPTED)
+
+    def parse_flag(self, body: dict, name: str) -> bool:
+        value = body.get(name, False)
+        if not isinstance(value, bool):
+            raise ValueError(f"'{name}' must be true or false")
+        return value
+
+    def parse_jobs(self, body: dict) -> dict[str, list[str]]:
+        if not isinstance(body, dict):
+            raise ValueError("Expected a JSON object")
+
+        if "lines" in body:
+            lines: list[str] = body["lines"]
+            if isinstance(lines, str):
+                lines = lines.splitlines()
+            if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+                raise ValueError("'lines' must be a string or a list of strings")
+            jobs, invalid_lines = parse_job_lines(lines)
+            if invalid_lines:
+                raise ValueError(f"Incorrect format on lines {invalid_lines}")
+        elif "jobs" in body:
+            if not isinstance(body["jobs"], dict):
+                raise ValueError("'jobs' must map machine numbers to lists of pg_ids")
+            jobs = dict()
+            for machine, pg_ids in body["jobs"].items():
+                if not re.fullmatch(r"[0-9]{1,2}", str(machine)):
+                    raise ValueError(f"Invalid machine number {machine!r}")
+                if not isinstance(pg_ids, list):
+                    raise ValueError(f"pg_ids for machine {machine} must be a list")
+                key: str = f"{int(machine):02d}"
+                for pg_id in pg_ids:
+                    if not isinstance(pg_id, str) or not PG_ID_REGEX.fullmatch(pg_id):
+                        raise ValueError(f"Invalid pg_id {pg_id!r} (expected a 4-digit string)")
+                    if pg_id not in jobs.setdefault(key, []):
+                        jobs[key].append(pg_id)
+        else:
+            raise ValueError("Expected 'lines' or 'jobs'")
+
+        if not jobs:
+            raise ValueError("No jobs submitted")
+        return jobs
+
+    def send_job_file(self, job_id: str, file_parts: list[str]) -> None:
+        job: Job | None = self.service.get(job_id)
+        if not job or job.status != "done":
+            self.send_error(HTTPStatus.NOT_FOUND, "Unknown or unfinished job")
+            return
+
+        job_dir: Path = self.service.job_dir(job)
+        file_path: Path = job_dir.joinpath(*[unquote(part) for part in file_parts]).resolve()
+        if not file_path.is_relative_to(job_dir) or not file_path.is_file():
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        data: bytes = file_path.read_bytes()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, data, status: HTTPStatus = HTTPStatus.OK) -> None:
+        body: bytes = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(service: JobService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    handler = type("BoundJobRequestHandler", (JobRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CNC Formatter job service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--db", type=Path, default=BASE_DIR / "machines.db")
+    parser.add_argument("--nc-dir", type=Path, default=None,
+                        help="NC file folder (defaults to the previous workday on the ERP share)")
+    parser.add_argument("--nc-root", type=Path, default=ERP_DIR,
+                        help="Folder that a job's own nc_dir must be inside")
+    parser.add_argument("--output-dir", type=Path, default=SERVICE_DIR / "jobs")
+    parser.add_argument("--cache-dir", type=Path, default=SERVICE_DIR / "cache")
+    parser.add_argument("--retention-hours", type=float,
+                        default=DEFAULT_RETENTION.total_seconds() / 3600,
+                        help="How long finished jobs and their output are kept")
+    args = parser.parse_args()
+
+    service: JobService = JobService(
+        args.output_dir,
+        args.cache_dir,
+        args.db,
+        args.nc_dir,
+        args.workers,
+        timedelta(hours=args.retention_hours),
+        args.nc_root,
+    )
+    server: ThreadingHTTPServer = make_server(service, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import bisect
+
+from machine_data import MachineData, AbutmentType, Diameter
+from machine_io import LABELS
+
+
+def get_capability_words(diameter: Diameter, abutment: AbutmentType) -> set[str]:
+    """Lower-cased words a search term can match for one capability.
+
+    These are the words of the labels shown in the Machines tab dropdowns
+    ("Ø14", "AOT & T-L", ...) plus the enum names used in import files.
+    """
+    words: set[str] = {diameter.name.lower(), abutment.name.lower()}
+    for member in (diameter, abutment):
+        for label, labelled in LABELS[type(member)].items():
+            if labelled == member:
+                words.update(label.lower().split())
+    return words
+
+
+class MachineIndex:
+    """In-memory copy of the machines table for the Machines tab.
+
+    Machines are keyed by machine_number and also grouped by capability so a
+    search never has to go back to SQLite. The results of the last search are
+    kept so that typing more characters only filters the previous matches.
+    """
+
+    def __init__(self, machines: list[MachineData] | None = None) -> None:
+        self.machines: dict[int, MachineData] = dict()
+        self.by_capability: dict[tuple[Diameter, AbutmentType], set[int]] = dict()
+        self.numbers: list[int] = []
+        self.last_query: str | None = None
+        self.last_results: list[int] = []
+        self.load(machines or [])
+
+    def load(self, machines: list[MachineData]) -> None:
+        self.machines.clear()
+        self.by_capability.clear()
+        self.numbers.clear()
+        for machine in machines:
+            self.put(machine)
+
+    def get(self, machine_number: int) -> MachineData | None:
+        return self.machines.get(machine_number)
+
+    def put(self, machine: MachineData) -> None:
+        if machine.machine_number in self.machines:
+            self.remove(machine.machine_number)
+
+        self.machines[machine.machine_number] = machine
+        self.by_capability.setdefault(
+            (machine.supported_diameter, machine.supported_abutment), set()
+        ).add(machine.machine_number)
+        bisect.insort(self.numbers, machine.machine_number)
+        self.last_query = None
+
+    def remove(self, machine_number: int) -> None:
+        machine: MachineData | None = self.machines.pop(machine_number, None)
+        if not machine:
+            return
+
+        self.by_capability[(machine.supported_diameter, machine.supported_abutment)].discard(
+            machine_number
+        )
+        del self.numbers[bisect.bisect_left(self.numbers, machine_number)]
+        self.last_query = None
+
+    def with_capability_term(self, term: str) -> set[int]:
+        """Machines whose diameter or abutment label has a word starting with term."""
+        numbers: set[int] = set()
+        for (diameter, abutment), machine_numbers in self.by_capability.items():
+            if any(word.startswith(term) for word in get_capability_words(diameter, abutment)):
+                numbers |= machine_numbers
+        return numbers
+
+    def search(self, query: str) -> list[int]:
+        """Return machine numbers matching every word in query.
+
+        Numbers match machine_number by prefix; other words match the words
+        of the diameter and abutment labels by prefix, so "Ø14", "asc" or
+        "AOT & T-L" work as typed. Every term only narrows the result, so a
+        query that extends the previous one is answered from the previous
+        results.
+        """
+        # Leading zeros are dropped first so "0" -> "05" is not treated as a
+        # narrowing of the previous query ("05" means machine 5, not "0...").
+        terms: list[str] = [
+            term.lstrip("0") or "0" if term.isdigit() else term
+            for term in query.strip().lower().split()
+        ]
+        query = " ".join(terms)
+        if self.last_query is not None and query.startswith(self.last_query):
+            candidates: list[int] = self.last_results
+        else:
+            candidates = self.numbers
+
+        numbers: list[str] = [term for term in terms if term.isdigit()]
+        allowed: set[int] | None = None
+        for term in terms:
+            if not term.isdigit():
+                matched: set[int] = self.with_capability_term(term)
+                allowed = matched if allowed is None else allowed & matched
+
+        results: list[int] = [
+            number for number in candidates
+            if (allowed is None or number in allowed)
+            and all(str(number).startswith(term) for term in numbers)
+        ]
+
+        self.last_query = query
+        self.last_results = results
+        return results
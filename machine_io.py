@@ -0,0 +1,152 @@
+import csv
+import json
+import re
+from pathlib import Path
+
+from machine_data import MachineData, AbutmentType, Diameter
+
+FIELDNAMES: list[str] = [
+    "machine_number",
+    "supported_diameter",
+    "supported_abutment",
+    "ending_machine_code",
+]
+
+
+# The labels shown in the Machines tab dropdowns.
+LABELS: dict[type, dict[str, Diameter | AbutmentType]] = {
+    Diameter: {
+        "Ø10": Diameter.PI10,
+        "Ø14": Diameter.PI14,
+    },
+    AbutmentType: {
+        "DS": AbutmentType.DS,
+        "ASC": AbutmentType.ASC,
+        "AOT & T-L": AbutmentType.AOT_AND_TLOC,
+        "AOT PLUS": AbutmentType.AOT_PLUS,
+    },
+}
+
+
+class MachineImportError(ValueError):
+    pass
+
+
+def parse_enum(enum_type, value, row_number: int, field: str):
+    labels: dict[str, Diameter | AbutmentType] = LABELS[enum_type]
+    if isinstance(value, str):
+        value = value.strip()
+        if value.upper() in enum_type.__members__:
+            return enum_type[value.upper()]
+        for label, member in labels.items():
+            if value.upper() == label.upper():
+                return member
+        # Not str.isdigit(), which accepts characters like "²" that int() rejects.
+        if re.fullmatch(r"-?[0-9]+", value):
+            value = int(value)
+
+    # bool is an int subclass, so JSON true would otherwise read as 1.
+    if isinstance(value, int) and not isinstance(value, bool):
+        try:
+            return enum_type(value)
+        except ValueError:
+            pass
+
+    choices: str = ", ".join(
+        f"{member.name} / '{label}' / {member.value}" for label, member in labels.items()
+    )
+    raise MachineImportError(
+        f"Row {row_number}: invalid {field} {value!r} (expected one of {choices})"
+    )
+
+
+def parse_machine(row: dict, row_number: int) -> MachineData:
+    missing: list[str] = [name for name in FIELDNAMES[:3] if row.get(name) in (None, "")]
+    if missing:
+        raise MachineImportError(f"Row {row_number}: missing {', '.join(missing)}")
+
+    try:
+        if isinstance(row["machine_number"], (bool, float)):
+            raise TypeError
+        machine_number: int = int(row["machine_number"])
+    except (TypeError, ValueError):
+        raise MachineImportError(
+            f"Row {row_number}: invalid machine_number '{row['machine_number']}'"
+        )
+    if machine_number < 1:
+        raise MachineImportError(
+            f"Row {row_number}: machine_number must be positive, got {machine_number}"
+        )
+
+    return MachineData(
+        machine_number,
+        parse_enum(Diameter, row["supported_diameter"], row_number, "supported_diameter"),
+        parse_enum(AbutmentType, row["supported_abutment"], row_number, "supported_abutment"),
+        row.get("ending_machine_code") or "",
+    )
+
+
+def read_machines(path: Path) -> list[MachineData]:
+    """Read machine settings from a .csv or .json file.
+
+    Every row is validated before anything is returned, so a bad file never
+    results in a partial import. Duplicate machine numbers keep the last row.
+    """
+    path = Path(path)
+    rows: list[dict]
+    try:
+        match path.suffix.lower():
+            case ".csv":
+                with path.open(newline="", encoding="utf-8-sig") as file:
+                    rows = list(csv.DictReader(file))
+            case ".json":
+                with path.open(encoding="utf-8-sig") as file:
+                    rows = json.load(file)
+            case _:
+                raise MachineImportError(f"Unsupported file type '{path.suffix}'")
+    except UnicodeDecodeError:
+        raise MachineImportError(f"{path.name} is not UTF-8 encoded (save it as CSV UTF-8)")
+    except json.JSONDecodeError as e:
+        raise MachineImportError(f"{path.name} is not valid JSON: {e}")
+    except csv.Error as e:
+        raise MachineImportError(f"{path.name} is not a valid CSV file: {e}")
+
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise MachineImportError("JSON file must contain a list of machine objects")
+
+    machines: dict[int, MachineData] = dict()
+    for i, row in enumerate(rows):
+        # DictReader puts values past the header under the None key.
+        if None in row:
+            raise MachineImportError(
+                f"Row {i + 1}: {len(row[None])} more values than there are columns"
+            )
+        machine: MachineData = parse_machine(row, i + 1)
+        machines[machine.machine_number] = machine
+
+    return list(machines.values())
+
+
+def write_machines(path: Path, machines: list[MachineData]) -> None:
+    path = Path(path)
+    rows: list[dict] = [
+        {
+            "machine_number": machine.machine_number,
+            "supported_diameter": machine.supported_diameter.name,
+            "supported_abutment": machine.supported_abutment.name,
+            "ending_machine_code": machine.ending_machine_code,
+        }
+        for machine in machines
+    ]
+
+    match path.suffix.lower():
+        case ".csv":
+            with path.open("w", newline="", encoding="utf-8") as file:
+                writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+                writer.writeheader()
+                writer.writerows(rows)
+        case ".json":
+            with path.open("w", encoding="utf-8") as file:
+                json.dump(rows, file, indent=4, ensure_ascii=False)
+        case _:
+            raise MachineImportError(f"Unsupported file type '{path.suffix}'")
@@ -0,0 +1,179 @@
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from machine_data import MachineData, Diameter
+
+HEADER_BYTES: int = 4096
+# Entries not looked up for this long are dropped when the index is saved.
+ENTRY_MAX_AGE_SECONDS: float = 30 * 24 * 3600
+LAST_SEEN_RESOLUTION_SECONDS: float = 24 * 3600
+O_NUMBER_REGEX: re.Pattern = re.compile(rb"^[ \t]*O(\d{1,5})", re.MULTILINE)
+COMMENT_REGEX: re.Pattern = re.compile(rb"\(([^()\r\n]*)\)")
+TOOL_CALL_REGEX: re.Pattern = re.compile(rb"(?<![A-Z#])T(\d{2,4})")
+DIAMETER_REGEX: re.Pattern = re.compile(r"(?:Ø|PI|DIA)\s*(10|14)(?!\d)", re.IGNORECASE)
+DIAMETERS: dict[str, Diameter] = {"10": Diameter.PI10, "14": Diameter.PI14}
+
+
+@dataclass
+class NCProgramInfo:
+    path: str
+    mtime: float
+    size: int
+    o_number: int | None = None
+    comment: str = ""
+    tool_calls: list[str] = field(default_factory=list)
+    line_count: int = 0
+    last_seen: float = 0.0
+
+    @property
+    def diameter(self) -> Diameter | None:
+        match: re.Match | None = DIAMETER_REGEX.search(self.comment)
+        if not match:
+            return None
+        return DIAMETERS[match.group(1)]
+
+
+def decode(data: bytes) -> str:
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace")
+
+
+def read_program_info(path: Path, stat: os.stat_result | None = None) -> NCProgramInfo:
+    """Extract header metadata from an NC program without loading it.
+
+    The file is memory-mapped and scanned with byte regexes, so only the
+    header comment and the matched tool numbers become Python strings.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    info: NCProgramInfo = NCProgramInfo(str(path), stat.st_mtime, stat.st_size, last_seen=time.time())
+    if stat.st_size == 0:
+        return info
+
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end: int = min(len(mm), HEADER_BYTES)
+            o_match: re.Match | None = O_NUMBER_REGEX.search(mm, 0, header_end)
+            if o_match:
+                info.o_number = int(o_match.group(1))
+                line_end: int = mm.find(b"\n", o_match.end())
+                comment_match: re.Match | None = COMMENT_REGEX.search(
+                    mm, o_match.end(), line_end if line_end != -1 else header_end
+                )
+                if comment_match:
+                    info.comment = decode(comment_match.group(1)).strip()
+
+            tool_calls: dict[str, None] = dict()
+            for tool_match in TOOL_CALL_REGEX.finditer(mm):
+                tool_calls[f"T{tool_match.group(1).decode()}"] = None
+            info.tool_calls = list(tool_calls)
+
+            line_count: int = 0
+            position: int = mm.find(b"\n")
+            while position != -1:
+                line_count += 1
+                position = mm.find(b"\n", position + 1)
+            if mm[-1:] != b"\n":
+                line_count += 1
+            info.line_count = line_count
+
+    return info
+
+
+def validate_program(info: NCProgramInfo, pg_id: str, machine_data: MachineData) -> list[str]:
+    problems: list[str] = []
+    if info.o_number is None:
+        problems.append(f"{pg_id}.prg has no O-number")
+    elif info.o_number != int(pg_id):
+        problems.append(f"{pg_id}.prg is O{info.o_number:04d}")
+
+    diameter: Diameter | None = info.diameter
+    if diameter is not None and diameter != machine_data.supported_diameter:
+        problems.append(f"{pg_id}.prg is for {diameter.name}, machine is {machine_data.supported_diameter.name}")
+    return problems
+
+
+class NCIndex:
+    """Cache of NCProgramInfo keyed by path, invalidated by mtime and size.
+
+    The cache can be saved to a JSON file so a restart doesn't have to map
+    every file on the ERP share again. The ERP share has a new folder every
+    day, so entries that haven't been looked up for ENTRY_MAX_AGE_SECONDS
+    are dropped on save. Safe to share between threads.
+    """
+
+    def __init__(self, cache_file: Path | None = None) -> None:
+        self.cache_file: Path | None = cache_file
+        self.entries: dict[str, NCProgramInfo] = dict()
+        self.lock: threading.Lock = threading.Lock()
+        self.dirty: bool = False
+        self.load()
+
+    def load(self) -> None:
+        if not self.cache_file or not self.cache_file.exists():
+            return
+        try:
+            with self.cache_file.open(encoding="utf-8") as file:
+                data: dict = json.load(file)
+            self.entries = {path: NCProgramInfo(**entry) for path, entry in data.items()}
+        except (OSError, ValueError, TypeError):
+            self.entries = dict()
+
+    def save(self) -> None:
+        if not self.cache_file:
+            return
+        with self.lock:
+            self.prune()
+            if not self.dirty:
+                return
+            data: dict = {path: asdict(info) for path, info in self.entries.items()}
+            temp_file: Path = self.cache_file.with_suffix(".tmp")
+            with temp_file.open("w", encoding="utf-8") as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(temp_file, self.cache_file)
+            self.dirty = False
+
+    def prune(self) -> None:
+        cutoff: float = time.time() - ENTRY_MAX_AGE_SECONDS
+        expired: list[str] = [
+            path for path, info in self.entries.items() if info.last_seen < cutoff
+        ]
+        for path in expired:
+            del self.entries[path]
+        if expired:
+            self.dirty = True
+
+    def get(self, path: Path) -> NCProgramInfo:
+        key: str = str(path)
+        try:
+            stat: os.stat_result = os.stat(path)
+        except FileNotFoundError:
+            with self.lock:
+                if self.entries.pop(key, None):
+                    self.dirty = True
+            raise
+
+        with self.lock:
+            info: NCProgramInfo | None = self.entries.get(key)
+            if info and info.mtime == stat.st_mtime and info.size == stat.st_size:
+                # Only refresh last_seen once a day so repeated plans don't
+                # rewrite the index file.
+                now: float = time.time()
+                if now - info.last_seen > LAST_SEEN_RESOLUTION_SECONDS:
+                    info.last_seen = now
+                    self.dirty = True
+                return info
+
+        info = read_program_info(path, stat)
+        with self.lock:
+            self.entries[key] = info
+            self.dirty = True
+        return info
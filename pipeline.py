@@ -0,0 +1,412 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, date
+from pathlib import Path
+from typing import Callable
+
+from db_util import DB
+from machine_data import MachineData, AbutmentType, Diameter
+from nc_index import NCIndex, NCProgramInfo, validate_program
+from scheduler import PROGRAM_SLOT_END, PROGRAM_SLOT_START, get_program_parts
+
+ERP_DIR: Path = Path(r"\\192.168.1.100\Trubox\####ERP_RM####")
+LINE_REGEX: re.Pattern = re.compile(
+    r"(?P<machine>[0-9]{2})_[0-9]{1}_[0-9]{3}\s+(?P<pg_id>[0-9]{4})(?![0-9a-zA-Z])"
+)
+PG_ID_REGEX: re.Pattern = re.compile(r"[0-9]{4}")
+ESTIMATED_BYTES_PER_SECOND: float = 4 * 1024 * 1024
+ESTIMATED_SECONDS_PER_FILE: float = 0.05
+
+
+@dataclass
+class ProgramFile:
+    name: str
+    content: str
+
+
+@dataclass
+class NCFile:
+    pg_id: str
+    source: Path
+    size: int
+
+
+@dataclass
+class MachinePlan:
+    machine: str
+    machine_data: MachineData
+    folder_name: str
+    program_files: list[ProgramFile]
+    nc_files: list[NCFile]
+    programs: list[NCProgramInfo] = field(default_factory=list)
+
+    @property
+    def file_count(self) -> int:
+        return len(self.program_files) + len(self.nc_files)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(len(program_file.content.encode()) for program_file in self.program_files) + sum(
+            nc_file.size for nc_file in self.nc_files
+        )
+
+    def describe(self) -> str:
+        summary: str = f"Machine {self.machine}: {len(self.nc_files)} programs, {format_size(self.total_bytes)}"
+        if self.programs:
+            tool_calls: dict[str, None] = dict()
+            for program in self.programs:
+                tool_calls.update(dict.fromkeys(program.tool_calls))
+            summary += f", {sum(program.line_count for program in self.programs)} lines"
+            if tool_calls:
+                summary += f", tools {' '.join(sorted(tool_calls))}"
+        return summary
+
+
+@dataclass
+class OutputPlan:
+    machines: list[MachinePlan] = field(default_factory=list)
+    missing_settings: list[str] = field(default_factory=list)
+    missing_nc_files: dict[str, list[str]] = field(default_factory=dict)
+    rejected_nc_files: dict[str, list[str]] = field(default_factory=dict)
+
+    @property
+    def file_count(self) -> int:
+        return sum(machine_plan.file_count for machine_plan in self.machines)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(machine_plan.total_bytes for machine_plan in self.machines)
+
+    @property
+    def estimated_seconds(self) -> float:
+        return (
+            self.total_bytes / ESTIMATED_BYTES_PER_SECOND
+            + self.file_count * ESTIMATED_SECONDS_PER_FILE
+        )
+
+    def has_problems(self) -> bool:
+        return bool(self.missing_settings or self.missing_nc_files or self.rejected_nc_files)
+
+    def describe_problems(self) -> str:
+        lines: list[str] = []
+        for machine in self.missing_settings:
+            lines.append(f"No machine settings for Machine {machine}")
+        for machine, pg_ids in self.missing_nc_files.items():
+            lines.append(f"Machine {machine}: missing {', '.join(pg_ids)}")
+        for machine, problems in self.rejected_nc_files.items():
+            lines.append(f"Machine {machine}: rejected {'; '.join(problems)}")
+        return "\n".join(lines)
+
+    def describe_machines(self) -> str:
+        return "\n".join(machine_plan.describe() for machine_plan in self.machines)
+
+    def describe(self) -> str:
+        return (
+            f"{len(self.machines)} folders, {self.file_count} files, "
+            f"{format_size(self.total_bytes)}, about {format_duration(self.estimated_seconds)}"
+        )
+
+
+def date_as_path(date: date | None = None) -> Path:
+    if date is None:
+        date = datetime.now().date()
+    _day: str = f"D{'0' + str(date.day) if date.day < 10 else str(date.day)}"
+    _month: str = f"M{'0' + str(date.month) if date.month < 10 else str(date.month)}"
+    _year: str = f"Y{str(date.year)}"
+    return Path(_year, _month, _day)
+
+
+def get_previous_workday_all_nc_path() -> Path:
+    current_date: date = datetime.now().date()
+    previous_date: date = current_date - timedelta(days=1)
+    if datetime.weekday(current_date) == 0:
+        previous_date = current_date - timedelta(days=3)
+
+    return ERP_DIR / date_as_path(previous_date) / Path("1. CAM/3. NC files/ALL")
+
+
+def parse_job_lines(lines: list[str]) -> tuple[dict[str, list[str]], list[int]]:
+    """Group ERP job lines by machine, returning the jobs and bad line numbers.
+
+    Blank lines are ignored and duplicate programs on one machine are dropped,
+    matching what the Process Data tab does.
+    """
+    machines: dict[str, list[str]] = dict()
+    invalid_lines: list[int] = []
+    for i, line in enumerate(lines):
+        if re.match(r"\s+[\n]?", line) or line == "":
+            continue
+
+        line_regex: re.Match | None = LINE_REGEX.match(line)
+        if not line_regex:
+            invalid_lines.append(i + 1)
+            continue
+
+        pg_ids: list[str] = machines.setdefault(line_regex.group("machine"), [])
+        if line_regex.group("pg_id") not in pg_ids:
+            pg_ids.append(line_regex.group("pg_id"))
+
+    return machines, invalid_lines
+
+
+def format_size(size: int) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{max(seconds, 1):.0f}s"
+    return f"{seconds // 60:.0f}m {seconds % 60:.0f}s"
+
+
+def get_machine_folder_name(machine: str, machine_data: MachineData) -> str:
+    machine_folder_name: list[str] = [f"Machine {machine}"]
+    match machine_data.supported_diameter:
+        case Diameter.PI10:
+            machine_folder_name.append("Ø10")
+        case Diameter.PI14:
+            machine_folder_name.append("Ø14")
+
+    match machine_data.supported_abutment:
+        case AbutmentType.ASC:
+            machine_folder_name.append("ASC")
+        case AbutmentType.AOT_AND_TLOC:
+            machine_folder_name.append("AOT&T-L")
+        case AbutmentType.AOT_PLUS:
+            machine_folder_name.append("AOT PLUS")
+
+    return " - ".join(machine_folder_name)
+
+
+def render_machine_program(
+    o_number: int, pg_ids: list[str], label: str, machine_data: MachineData
+) -> str:
+    lines: list[str] = [f"O{o_number}({label:<20})\n$1\n"]
+    num: int = 501
+    while num < PROGRAM_SLOT_START:
+        lines.append(f"#{num}=\nG4 U0.5\n")
+        num += 1
+
+    for pg_id in pg_ids:
+        lines.append(f"#{num}={pg_id}\nG4 U0.5\n")
+        num += 1
+
+    while num < PROGRAM_SLOT_END:
+        lines.append(f"#{num}=\nG4 U0.5\n")
+        num += 1
+
+    lines.append("\nM2\nM99\n\n\n$2\n\nM2\nM99\n\n")
+    lines.append(machine_data.ending_machine_code)
+    return "".join(lines)
+
+
+def index_nc_files(nc_dir: Path) -> dict[str, NCFile]:
+    """Map lower-cased file names in nc_dir to their path and size.
+
+    Uses a single directory scan so planning never opens the NC files.
+    """
+    index: dict[str, NCFile] = dict()
+    try:
+        with os.scandir(nc_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(".prg"):
+                    index[entry.name.lower()] = NCFile(
+                        Path(entry.name).stem, Path(entry.path), entry.stat().st_size
+                    )
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return index
+
+
+def plan_output(
+    jobs: dict[str, list[str]],
+    db: DB,
+    nc_dir: Path,
+    program_index: NCIndex | None = None,
+) -> OutputPlan:
+    """Work out everything execute_plan will write without writing anything.
+
+    With a program_index, each NC file's header is checked against its pg_id
+    and the machine's diameter; mismatched programs are rejected instead of
+    being copied. Missing and rejected programs are left out of the machine
+    program as well. The index is not saved here; that is up to the caller.
+    """
+    plan: OutputPlan = OutputPlan()
+    nc_files_by_name: dict[str, NCFile] = index_nc_files(nc_dir)
+
+    for machine, pg_ids in jobs.items():
+        machine_data: MachineData | None = db.get_machine_by_machine_number(int(machine))
+        if not machine_data:
+            plan.missing_settings.append(machine)
+            continue
+
+        nc_files: list[NCFile] = []
+        programs: list[NCProgramInfo] = []
+        for pg_id in pg_ids:
+            nc_file: NCFile | None = nc_files_by_name.get(f"{pg_id}.prg".lower())
+            if not nc_file:
+                plan.missing_nc_files.setdefault(machine, []).append(pg_id)
+                continue
+
+            if program_index:
+                program: NCProgramInfo = program_index.get(nc_file.source)
+                problems: list[str] = validate_program(program, pg_id, machine_data)
+                if problems:
+                    plan.rejected_nc_files.setdefault(machine, []).extend(problems)
+                    continue
+                programs.append(program)
+
+            nc_files.append(NCFile(pg_id, nc_file.source, nc_file.size))
+
+        # Only programs that will actually be copied get a #5xx slot, so the
+        # machine is never told to run a missing or rejected program.
+        program_files: list[ProgramFile] = [
+            ProgramFile(
+                part.name,
+                render_machine_program(part.o_number, part.pg_ids, part.label, machine_data),
+            )
+            for part in get_program_parts(machine, [nc_file.pg_id for nc_file in nc_files])
+        ]
+
+        plan.machines.append(
+            MachinePlan(
+                machine,
+                machine_data,
+                get_machine_folder_name(machine, machine_data),
+                program_files,
+                nc_files,
+                programs,
+            )
+        )
+
+    return plan
+
+
+def execute_plan(
+    plan: OutputPlan,
+    output_dir: Path,
+    on_progress: Callable[[str], None] | None = None,
+    fetch: Callable[[NCFile], Path] | None = None,
+) -> None:
+    """Build the planned output in a staging folder and swap it into place.
+
+    The staging folder sits next to output_dir so the final swap is a pair of
+    renames on the same filesystem (see swap_into_place). If anything fails
+    before the swap the staging folder is removed and output_dir is left
+    exactly as it was. fetch, if given, maps
+    each NC file to the local path it should be copied from (e.g. a cache).
+    """
+    output_dir = Path(output_dir).resolve()
+    output_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging_dir: Path = Path(
+        tempfile.mkdtemp(prefix=f".{output_dir.name}-staging-", dir=output_dir.parent)
+    )
+
+    try:
+        for machine_plan in plan.machines:
+            machine_folder: Path = staging_dir / machine_plan.folder_name
+            machine_folder.mkdir()
+
+            for program_file in machine_plan.program_files:
+                if on_progress:
+                    on_progress(f"Writing {program_file.name} to {machine_plan.folder_name}")
+                with (machine_folder / program_file.name).open("w") as file:
+                    file.write(program_file.content)
+
+            for nc_file in machine_plan.nc_files:
+                if on_progress:
+                    on_progress(f"Copying {nc_file.pg_id}.prg to {machine_plan.folder_name}")
+                source: Path = fetch(nc_file) if fetch else nc_file.source
+                shutil.copy2(source, machine_folder / f"{nc_file.pg_id}.prg")
+
+        swap_into_place(staging_dir, output_dir)
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+
+def swap_into_place(staging_dir: Path, output_dir: Path) -> None:
+    """Replace output_dir with staging_dir, keeping loose files in output_dir.
+
+    Only the machine folders are regenerated; files sitting directly in
+    output_dir are copied into staging_dir first, so a failed copy leaves
+    output_dir untouched. The swap itself is not atomic: a folder can't be
+    renamed over a non-empty one (on Windows not at all), so output_dir is
+    moved aside and staging_dir renamed in its place. For the moment in
+    between output_dir does not exist; if the second rename fails the old
+    folder is moved back.
+    """
+    if not output_dir.exists():
+        os.rename(staging_dir, output_dir)
+        return
+
+    for file in output_dir.iterdir():
+        if not file.is_dir() and not (staging_dir / file.name).exists():
+            shutil.copy2(file, staging_dir / file.name)
+
+    old_dir: Path = staging_dir.with_name(staging_dir.name.replace("-staging-", "-old-"))
+    os.rename(output_dir, old_dir)
+    try:
+        os.rename(staging_dir, output_dir)
+    except OSError:
+        os.rename(old_dir, output_dir)
+        raise
+
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class NCFileCache:
+    """Local copies of NC files from the ERP share, shared between jobs.
+
+    Each source file maps to a fixed path under cache_dir. copy2 keeps the
+    source mtime, so a cached copy is reused whenever its size and mtime
+    still match the source; the cache on disk is its own index and stays
+    warm across restarts. Concurrent requests for the same file wait for the
+    first.
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.cache_dir: Path = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.locks: dict[Path, threading.Lock] = dict()
+        self.lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def fetch(self, nc_file: NCFile) -> Path:
+        with self.lock:
+            file_lock: threading.Lock = self.locks.setdefault(nc_file.source, threading.Lock())
+
+        with file_lock:
+            folder: Path = self.cache_dir / hashlib.sha1(
+                str(nc_file.source.parent).encode()
+            ).hexdigest()[:12]
+            cached_path: Path = folder / nc_file.source.name
+            stat: os.stat_result = nc_file.source.stat()
+            try:
+                cached: os.stat_result | None = cached_path.stat()
+            except FileNotFoundError:
+                cached = None
+
+            # Allow for filesystems that store mtimes at a coarser resolution.
+            if cached and cached.st_size == stat.st_size and abs(cached.st_mtime - stat.st_mtime) < 1:
+                with self.lock:
+                    self.hits += 1
+                return cached_path
+
+            folder.mkdir(exist_ok=True)
+            temp_path: Path = cached_path.with_name(f".{cached_path.name}.tmp")
+            shutil.copy2(nc_file.source, temp_path)
+            os.replace(temp_path, cached_path)
+            with self.lock:
+                self.misses += 1
+            return cached_path
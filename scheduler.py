@@ -0,0 +1,174 @@
+from dataclasses import dataclass
+
+from machine_data import MachineData, AbutmentType, Diameter
+
+PROGRAM_SLOT_START: int = 506
+PROGRAM_SLOT_END: int = 600
+PROGRAM_CAPACITY: int = PROGRAM_SLOT_END - PROGRAM_SLOT_START
+# NC programs are O0000-O9999 (their 4-digit pg_id), so later parts of a split
+# list are numbered from here to stay clear of them.
+PART_O_NUMBER_BASE: int = 10000
+
+
+@dataclass
+class MachineLoad:
+    machine: str
+    program_count: int
+    file_count: int
+    moved_in: int = 0
+    moved_out: int = 0
+
+
+@dataclass
+class ProgramPart:
+    name: str
+    o_number: int
+    label: str
+    pg_ids: list[str]
+
+
+def machine_key(machine_number: int) -> str:
+    return f"{machine_number:02d}"
+
+
+def split_programs(pg_ids: list[str], capacity: int = PROGRAM_CAPACITY) -> list[list[str]]:
+    """Split a program list into chunks that fit the #506-#599 variable slots.
+
+    An empty list still yields one (empty) chunk so the machine file is written.
+    """
+    if not pg_ids:
+        return [[]]
+    return [pg_ids[i:i + capacity] for i in range(0, len(pg_ids), capacity)]
+
+
+def get_part_o_number(machine_number: int, part: int, base: int = PART_O_NUMBER_BASE) -> int:
+    """O-number of one part of a machine's program list.
+
+    Part 1 keeps O{machine} so single-part output is unchanged; later parts
+    get base + machine * 100 + part (machine 12 part 2 is O11202), which
+    can't be the O-number of an NC program.
+    """
+    if part == 1:
+        return machine_number
+    return base + machine_number * 100 + part
+
+
+def get_program_parts(
+    machine: str, pg_ids: list[str], capacity: int = PROGRAM_CAPACITY
+) -> list[ProgramPart]:
+    """Split a machine's programs into separate machine files.
+
+    The parts are independent programs: nothing calls from one part to the
+    next, so each file has to be loaded and run on its own.
+    """
+    batches: list[list[str]] = split_programs(pg_ids, capacity)
+    if len(batches) == 1:
+        return [ProgramPart(f"{int(machine)}.prg", int(machine), "FOR INPUT", batches[0])]
+
+    parts: list[ProgramPart] = []
+    for part, batch in enumerate(batches, start=1):
+        parts.append(
+            ProgramPart(
+                f"{int(machine)}.prg" if part == 1 else f"{int(machine)}_{part}.prg",
+                get_part_o_number(int(machine), part),
+                f"FOR INPUT {part} OF {len(batches)}",
+                batch,
+            )
+        )
+    return parts
+
+
+def balance_jobs(
+    jobs: dict[str, list[str]], machines: list[MachineData]
+) -> dict[str, list[str]]:
+    """Spread jobs across machines that share a diameter and abutment type.
+
+    Within each capability group the longest queue is brought down to
+    ceil(total / machines). Machines keep as many of their own jobs as their
+    share allows and only the overflow is moved, in order, to the machines
+    with the most room. A job is never moved to a machine that already has
+    that program; if no machine can take it, it stays where it was. Jobs for
+    machines without settings are left alone.
+    """
+    groups: dict[tuple[Diameter, AbutmentType], list[str]] = dict()
+    for machine in machines:
+        capability = (machine.supported_diameter, machine.supported_abutment)
+        groups.setdefault(capability, []).append(machine_key(machine.machine_number))
+
+    grouped: set[str] = {key for keys in groups.values() for key in keys}
+    balanced: dict[str, list[str]] = {
+        key: list(pg_ids) for key, pg_ids in jobs.items() if key not in grouped
+    }
+
+    for keys in groups.values():
+        total: int = sum(len(jobs.get(key, [])) for key in keys)
+        if total == 0:
+            continue
+
+        # The busiest machines get the remainder so fewer jobs have to move.
+        keys = sorted(keys, key=lambda key: len(jobs.get(key, [])), reverse=True)
+        base, extra = divmod(total, len(keys))
+        quotas: dict[str, int] = {
+            key: base + (1 if i < extra else 0) for i, key in enumerate(keys)
+        }
+
+        overflow: list[tuple[str, str]] = []
+        for key in keys:
+            pg_ids: list[str] = jobs.get(key, [])
+            balanced[key] = list(pg_ids[:quotas[key]])
+            overflow.extend((key, pg_id) for pg_id in pg_ids[quotas[key]:])
+
+        for origin, pg_id in overflow:
+            targets: list[str] = [
+                key for key in keys
+                if len(balanced[key]) < quotas[key] and pg_id not in balanced[key]
+            ]
+            if targets:
+                target: str = max(targets, key=lambda key: quotas[key] - len(balanced[key]))
+            else:
+                target = origin
+            balanced[target].append(pg_id)
+
+    return {
+        key: balanced[key]
+        for key in sorted(balanced, key=int)
+        if balanced[key]
+    }
+
+
+def get_machine_loads(
+    jobs: dict[str, list[str]],
+    original_jobs: dict[str, list[str]] | None = None,
+    capacity: int = PROGRAM_CAPACITY,
+) -> list[MachineLoad]:
+    if original_jobs is None:
+        original_jobs = jobs
+
+    loads: list[MachineLoad] = []
+    for machine in sorted(set(jobs) | set(original_jobs), key=int):
+        current: list[str] = jobs.get(machine, [])
+        original: list[str] = original_jobs.get(machine, [])
+        loads.append(
+            MachineLoad(
+                machine,
+                len(current),
+                len(split_programs(current, capacity)) if current else 0,
+                len(set(current) - set(original)),
+                len(set(original) - set(current)),
+            )
+        )
+    return loads
+
+
+def format_load_report(loads: list[MachineLoad]) -> str:
+    lines: list[str] = []
+    for load in loads:
+        line: str = f"Machine {load.machine}: {load.program_count} programs"
+        if load.file_count > 1:
+            line += f" in {load.file_count} separate files, run each on its own"
+        if load.moved_in:
+            line += f", +{load.moved_in} moved in"
+        if load.moved_out:
+            line += f", -{load.moved_out} moved out"
+        lines.append(line)
+    return "\n".join(lines)
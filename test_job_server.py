@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+import pytest
+
+from db_util import DB
+from job_server import JobService, make_server
+from machine_data import MachineData, AbutmentType, Diameter
+
+FOLDER: str = "Machine 01 - Ø14"
+
+
+@pytest.fixture
+def server(tmp_path):
+    db = DB(tmp_path / "machines.db")
+    db.init_db()
+    db.add_machine(MachineData(1, Diameter.PI14, AbutmentType.DS, ""))
+    db.con.commit()
+    db.con.close()
+
+    # A local stand-in for the ERP share.
+    nc_root = tmp_path / "erp"
+    nc_dir = nc_root / "ALL"
+    nc_dir.mkdir(parents=True)
+    for pg_id in ["1000", "1001"]:
+        (nc_dir / f"{pg_id}.prg").write_text(f"%\nO{pg_id}(Ø14)\n%\n")
+    (tmp_path / "secret").mkdir()
+    (tmp_path / "secret" / "1000.prg").write_text("secret")
+
+    service = JobService(
+        tmp_path / "jobs", tmp_path / "cache", tmp_path / "machines.db", nc_dir, workers=2, nc_root=nc_root
+    )
+    http_server = make_server(service, port=0)
+    thread = threading.Thread(target=http_server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{http_server.server_address[1]}"
+    http_server.shutdown()
+    http_server.server_close()
+    service.shutdown()
+
+
+def request(url: str, body=None, headers: dict | None = None) -> tuple[int, bytes]:
+    data: bytes | None = body if isinstance(body, bytes) or body is None else json.dumps(body).encode()
+    req = urllib.request.Request(url, data=data, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def submit(server: str, body: dict) -> dict:
+    status, data = request(f"{server}/jobs", body)
+    assert status == 202, data
+    return json.loads(data)
+
+
+def wait(server: str, job_id: str) -> dict:
+    for _ in range(200):
+        job: dict = json.loads(request(f"{server}/jobs/{job_id}")[1])
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise TimeoutError(job_id)
+
+
+def test_submit_poll_and_download(server):
+    job = wait(server, submit(server, {"lines": ["01_1_001 1000", "01_1_002 1001"]})["id"])
+    assert job["status"] == "done", job["error"]
+    assert f"{FOLDER}/1000.prg" in job["files"]
+    assert job["strict"] is False
+
+    status, data = request(f"{server}/jobs/{job['id']}/files/{quote(FOLDER)}/1000.prg")
+    assert status == 200
+    assert data.startswith(b"%\nO1000")
+
+
+def test_download_rejects_path_traversal(server):
+    job = wait(server, submit(server, {"jobs": {"1": ["1000"]}})["id"])
+    assert job["status"] == "done"
+    for path in ["..%2F..%2Fmachines.db", "%2E%2E/%2E%2E/machines.db"]:
+        assert request(f"{server}/jobs/{job['id']}/files/{path}")[0] == 404
+
+
+@pytest.mark.parametrize("body", [
+    {"jobs": {"1": "1000"}},
+    {"jobs": {"1": ["1000\nM30"]}},
+    {"jobs": {"123": ["1000"]}},
+    {"jobs": []},
+    {"lines": ["not a job line"]},
+    {"lines": [1000]},
+    {"lines": []},
+    {"jobs": {"1": ["1000"]}, "balance": "false"},
+    {"jobs": {"1": ["1000"]}, "strict": 1},
+    {"jobs": {"1": ["1000"]}, "nc_dir": "../secret"},
+    {"jobs": {"1": ["1000"]}, "nc_dir": "/"},
+    [],
+])
+def test_bad_requests_are_rejected(server, body):
+    assert request(f"{server}/jobs", body)[0] == 400
+
+
+def test_bad_content_length_is_rejected(server):
+    assert request(f"{server}/jobs", b"{}", {"Content-Length": "-1"})[0] == 400
+
+
+def test_nc_dir_inside_root_is_accepted(server):
+    job = wait(server, submit(server, {"jobs": {"1": ["1000"]}, "nc_dir": "ALL"})["id"])
+    assert job["status"] == "done"
+
+
+def test_strict_job_fails_on_problems(server):
+    job = wait(server, submit(server, {"jobs": {"1": ["1000", "9999"]}, "strict": True})["id"])
+    assert job["status"] == "failed"
+    assert "strict" in job["error"]
+    assert job["problems"] == ["Machine 01: missing 9999"]
+
+
+def test_second_job_hits_the_cache(server):
+    for _ in range(2):
+        assert wait(server, submit(server, {"jobs": {"1": ["1000", "1001"]}})["id"])["status"] == "done"
+    assert json.loads(request(f"{server}/cache")[1]) == {"hits": 2, "misses": 2}
@@ -0,0 +1,45 @@
+from machine_data import MachineData, AbutmentType, Diameter
+from machine_index import MachineIndex
+
+
+def make_index() -> MachineIndex:
+    return MachineIndex([
+        MachineData(number, Diameter(number % 2), AbutmentType(number % 4 + 1), "")
+        for number in range(1, 60)
+    ])
+
+
+def test_incremental_search_matches_fresh_search():
+    index = make_index()
+    for query in ["0", "05", "05 ø", "05 ø1", "1", "12", "a", "as", "asc ø10", "aot", "aot &", "aot & t-l"]:
+        assert index.search(query) == make_index().search(query), query
+
+
+def test_leading_zeros_match_machine_number():
+    index = make_index()
+    assert index.search("0") == []
+    assert index.search("05") == [5, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59]
+
+
+def test_edits_invalidate_previous_results():
+    index = make_index()
+    assert 5 in index.search("5")
+    index.remove(5)
+    assert 5 not in index.search("5")
+    index.put(MachineData(5, Diameter.PI14, AbutmentType.DS, ""))
+    assert 5 in index.search("5 ø14")
+
+
+def test_search_matches_tab_labels():
+    index = make_index()
+    tloc = [number for number in index.numbers if index.get(number).supported_abutment == AbutmentType.AOT_AND_TLOC]
+    assert index.search("AOT & T-L") == tloc
+    assert index.search("aot plus") == [
+        number for number in index.numbers if index.get(number).supported_abutment == AbutmentType.AOT_PLUS
+    ]
+    assert index.search("1 Ø14 aot & t-l") == [
+        number for number in tloc
+        if str(number).startswith("1") and index.get(number).supported_diameter == Diameter.PI14
+    ]
+    assert index.search("pi10 ds") == index.search("Ø10 DS")
+    assert index.search("x") == []
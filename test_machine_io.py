@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from db_util import DB
+from machine_data import MachineData, AbutmentType, Diameter
+from machine_io import MachineImportError, parse_enum, read_machines, write_machines
+
+MACHINES: list[MachineData] = [
+    MachineData(1, Diameter.PI10, AbutmentType.DS, ""),
+    MachineData(12, Diameter.PI14, AbutmentType.AOT_AND_TLOC, 'M30\n(END, "12")\n'),
+]
+
+
+def make_db(tmp_path) -> DB:
+    db = DB(tmp_path / "machines.db")
+    db.init_db()
+    return db
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".json"])
+def test_round_trip(tmp_path, suffix):
+    path = tmp_path / f"machines{suffix}"
+    write_machines(path, MACHINES)
+    assert read_machines(path) == MACHINES
+
+
+@pytest.mark.parametrize("value", ["PI14", "pi14", "Ø14", "ø14", "1", 1])
+def test_parse_enum_accepts_names_labels_and_values(value):
+    assert parse_enum(Diameter, value, 1, "supported_diameter") == Diameter.PI14
+
+
+@pytest.mark.parametrize("value", [True, "²", "7", "Ø12", 1.0])
+def test_parse_enum_rejects_other_values(value):
+    with pytest.raises(MachineImportError):
+        parse_enum(Diameter, value, 1, "supported_diameter")
+
+
+def test_parse_enum_accepts_tab_labels():
+    assert parse_enum(AbutmentType, "AOT & T-L", 1, "supported_abutment") == AbutmentType.AOT_AND_TLOC
+    assert parse_enum(AbutmentType, "aot plus", 1, "supported_abutment") == AbutmentType.AOT_PLUS
+
+
+@pytest.mark.parametrize("content", [
+    "machine_number,supported_diameter,supported_abutment\n1,²,DS\n",
+    "machine_number,supported_diameter,supported_abutment\n1,PI10,DS,extra\n",
+    "machine_number,supported_diameter,supported_abutment\n1,PI10\n",
+])
+def test_read_machines_rejects_malformed_csv(tmp_path, content):
+    path = tmp_path / "machines.csv"
+    path.write_text(content, encoding="utf-8")
+    with pytest.raises(MachineImportError):
+        read_machines(path)
+
+
+def test_read_machines_rejects_json_booleans(tmp_path):
+    path = tmp_path / "machines.json"
+    path.write_text(
+        '[{"machine_number": true, "supported_diameter": 0, "supported_abutment": 1}]',
+        encoding="utf-8",
+    )
+    with pytest.raises(MachineImportError):
+        read_machines(path)
+
+
+def test_upsert_overwrites_existing_rows(tmp_path):
+    db = make_db(tmp_path)
+    db.add_machine(MachineData(1, Diameter.PI14, AbutmentType.ASC, "OLD"))
+    db.con.commit()
+
+    db.upsert_machines(MACHINES)
+    assert db.get_all_machines() == MACHINES
+
+
+def test_upsert_is_one_transaction(tmp_path):
+    db = make_db(tmp_path)
+    db.add_machine(MACHINES[0])
+    db.con.commit()
+
+    broken: MachineData = MachineData(None, Diameter.PI10, AbutmentType.DS, "")
+    with pytest.raises(sqlite3.IntegrityError):
+        db.upsert_machines([MachineData(1, Diameter.PI14, AbutmentType.ASC, ""), MACHINES[1], broken])
+    assert db.get_all_machines() == [MACHINES[0]]
@@ -0,0 +1,97 @@
+import os
+import time
+
+from db_util import DB
+from machine_data import MachineData, AbutmentType, Diameter
+from nc_index import ENTRY_MAX_AGE_SECONDS, NCIndex, read_program_info, validate_program
+from pipeline import plan_output
+
+MACHINE: MachineData = MachineData(1, Diameter.PI14, AbutmentType.DS, "")
+
+
+def write_program(path, text: str, encoding: str = "utf-8"):
+    path.write_bytes(text.encode(encoding))
+    return path
+
+
+def test_read_program_info(tmp_path):
+    path = write_program(
+        tmp_path / "1000.prg",
+        "%\nO1000(ABUTMENT Ø14 ASC)\nT0101\nG0 X0\nT0202 M6\nT0101\n%",
+    )
+    info = read_program_info(path)
+    assert info.o_number == 1000
+    assert info.comment == "ABUTMENT Ø14 ASC"
+    assert info.tool_calls == ["T0101", "T0202"]
+    assert info.line_count == 7
+    assert info.size == path.stat().st_size
+    assert info.diameter == Diameter.PI14
+
+
+def test_read_program_info_cp1252_and_empty(tmp_path):
+    info = read_program_info(write_program(tmp_path / "1001.prg", "%\nO1001(AOT Ø10)\n%\n", "cp1252"))
+    assert info.comment == "AOT Ø10"
+    assert info.diameter == Diameter.PI10
+    assert info.line_count == 3
+
+    empty = read_program_info(write_program(tmp_path / "1002.prg", ""))
+    assert (empty.o_number, empty.line_count) == (None, 0)
+
+
+def test_validate_program(tmp_path):
+    ok = read_program_info(write_program(tmp_path / "a.prg", "%\nO1000(Ø14)\n%\n"))
+    assert validate_program(ok, "1000", MACHINE) == []
+
+    wrong_o = read_program_info(write_program(tmp_path / "b.prg", "%\nO9999\n%\n"))
+    assert validate_program(wrong_o, "1001", MACHINE) == ["1001.prg is O9999"]
+
+    wrong_diameter = read_program_info(write_program(tmp_path / "c.prg", "%\nO1002(PI10)\n%\n"))
+    assert validate_program(wrong_diameter, "1002", MACHINE) == ["1002.prg is for PI10, machine is PI14"]
+
+    no_o = read_program_info(write_program(tmp_path / "d.prg", "G0 X0\n"))
+    assert validate_program(no_o, "1003", MACHINE) == ["1003.prg has no O-number"]
+
+
+def test_index_reuses_entries_until_file_changes(tmp_path):
+    path = write_program(tmp_path / "1000.prg", "%\nO1000\n%\n")
+    index = NCIndex(tmp_path / "index.json")
+    first = index.get(path)
+    assert index.get(path) is first
+
+    write_program(path, "%\nO1000\nT0101\n%\n")
+    os.utime(path, (first.mtime + 10, first.mtime + 10))
+    assert index.get(path).tool_calls == ["T0101"]
+
+
+def test_index_save_prunes_old_entries(tmp_path):
+    path = write_program(tmp_path / "1000.prg", "%\nO1000\n%\n")
+    index = NCIndex(tmp_path / "index.json")
+    index.get(path)
+    index.entries["gone.prg"] = read_program_info(path)
+    index.entries["gone.prg"].last_seen = time.time() - ENTRY_MAX_AGE_SECONDS - 1
+    index.save()
+
+    assert list(NCIndex(tmp_path / "index.json").entries) == [str(path)]
+
+
+def test_plan_leaves_missing_and_rejected_programs_out_of_slots(tmp_path):
+    db = DB(tmp_path / "machines.db")
+    db.init_db()
+    db.add_machine(MACHINE)
+    db.con.commit()
+
+    nc_dir = tmp_path / "nc"
+    nc_dir.mkdir()
+    write_program(nc_dir / "1000.prg", "%\nO1000(Ø14)\n%\n")
+    write_program(nc_dir / "1001.prg", "%\nO9999\n%\n")
+    write_program(nc_dir / "1002.prg", "%\nO1002(Ø10)\n%\n")
+
+    index = NCIndex()
+    plan = plan_output({"01": ["1000", "1001", "1002", "1003"]}, db, nc_dir, index)
+
+    assert plan.missing_nc_files == {"01": ["1003"]}
+    assert len(plan.rejected_nc_files["01"]) == 2
+    machine_plan = plan.machines[0]
+    assert [nc_file.pg_id for nc_file in machine_plan.nc_files] == ["1000"]
+    slots = [line for line in machine_plan.program_files[0].content.splitlines() if "=1" in line]
+    assert slots == ["#506=1000"]
@@ -0,0 +1,66 @@
+import pytest
+
+from db_util import DB
+from machine_data import MachineData, AbutmentType, Diameter
+from pipeline import execute_plan, plan_output
+
+MACHINE: MachineData = MachineData(1, Diameter.PI14, AbutmentType.DS, "")
+FOLDER: str = "Machine 01 - Ø14"
+
+
+def make_plan(tmp_path):
+    db = DB(tmp_path / "machines.db")
+    db.init_db()
+    db.add_machine(MACHINE)
+    db.con.commit()
+
+    nc_dir = tmp_path / "nc"
+    nc_dir.mkdir()
+    for pg_id in ["1000", "1001"]:
+        (nc_dir / f"{pg_id}.prg").write_text(f"%\nO{pg_id}\n%\n")
+    return plan_output({"01": ["1000", "1001"]}, db, nc_dir), nc_dir
+
+
+def make_old_output(tmp_path):
+    output_dir = tmp_path / "output"
+    (output_dir / FOLDER).mkdir(parents=True)
+    (output_dir / FOLDER / "9999.prg").write_text("old")
+    (output_dir / "notes.txt").write_text("keep me")
+    return output_dir
+
+
+def leftovers(tmp_path) -> list[str]:
+    return [path.name for path in tmp_path.iterdir() if path.name.startswith(".output-")]
+
+
+def test_execute_plan_replaces_machine_folders_and_keeps_loose_files(tmp_path):
+    plan, _ = make_plan(tmp_path)
+    output_dir = make_old_output(tmp_path)
+
+    execute_plan(plan, output_dir)
+
+    assert sorted(path.name for path in (output_dir / FOLDER).iterdir()) == ["1.prg", "1000.prg", "1001.prg"]
+    assert (output_dir / "notes.txt").read_text() == "keep me"
+    assert leftovers(tmp_path) == []
+
+
+def test_execute_plan_leaves_output_untouched_when_a_source_disappears(tmp_path):
+    plan, nc_dir = make_plan(tmp_path)
+    output_dir = make_old_output(tmp_path)
+    (nc_dir / "1001.prg").unlink()
+
+    with pytest.raises(FileNotFoundError):
+        execute_plan(plan, output_dir)
+
+    assert sorted(path.name for path in (output_dir / FOLDER).iterdir()) == ["9999.prg"]
+    assert (output_dir / "notes.txt").read_text() == "keep me"
+    assert leftovers(tmp_path) == []
+
+
+def test_execute_plan_creates_missing_output_dir(tmp_path):
+    plan, _ = make_plan(tmp_path)
+
+    execute_plan(plan, tmp_path / "output")
+
+    assert (tmp_path / "output" / FOLDER / "1.prg").exists()
+    assert leftovers(tmp_path) == []
@@ -0,0 +1,79 @@
+from machine_data import MachineData, AbutmentType, Diameter
+from scheduler import (
+    PROGRAM_CAPACITY,
+    balance_jobs,
+    format_load_report,
+    get_machine_loads,
+    get_program_parts,
+    split_programs,
+)
+
+
+def make_machine(machine_number: int, diameter: Diameter = Diameter.PI10) -> MachineData:
+    return MachineData(machine_number, diameter, AbutmentType.DS, "")
+
+
+def pg_ids(count: int, start: int = 1000) -> list[str]:
+    return [str(start + i) for i in range(count)]
+
+
+def test_split_programs_fits_slots():
+    assert PROGRAM_CAPACITY == 94
+    assert split_programs([]) == [[]]
+    assert split_programs(pg_ids(94)) == [pg_ids(94)]
+    assert [len(batch) for batch in split_programs(pg_ids(200))] == [94, 94, 12]
+
+
+def test_single_part_keeps_original_header():
+    parts = get_program_parts("05", pg_ids(3))
+    assert len(parts) == 1
+    assert (parts[0].name, parts[0].o_number, parts[0].label) == ("5.prg", 5, "FOR INPUT")
+
+
+def test_parts_have_distinct_o_numbers_and_labels():
+    parts = get_program_parts("05", pg_ids(200))
+    assert [part.name for part in parts] == ["5.prg", "5_2.prg", "5_3.prg"]
+    assert [part.o_number for part in parts] == [5, 10502, 10503]
+    assert [part.label for part in parts] == [
+        "FOR INPUT 1 OF 3",
+        "FOR INPUT 2 OF 3",
+        "FOR INPUT 3 OF 3",
+    ]
+    assert sum((part.pg_ids for part in parts), []) == pg_ids(200)
+
+
+def test_part_o_numbers_never_look_like_a_pg_id():
+    parts = get_program_parts("12", pg_ids(200))
+    assert [part.o_number for part in parts] == [12, 11202, 11203]
+    for machine in [1, 12, 99]:
+        for part in get_program_parts(f"{machine:02d}", pg_ids(94 * 98))[1:]:
+            assert part.o_number > 9999
+
+
+def test_balance_jobs_evens_out_compatible_machines():
+    jobs = {"01": pg_ids(10)}
+    balanced = balance_jobs(jobs, [make_machine(1), make_machine(2)])
+    assert balanced == {"01": pg_ids(5), "02": pg_ids(5, 1005)}
+
+
+def test_balance_jobs_ignores_incompatible_and_unknown_machines():
+    jobs = {"01": pg_ids(10), "07": ["2000"]}
+    balanced = balance_jobs(jobs, [make_machine(1), make_machine(2, Diameter.PI14)])
+    assert balanced == jobs
+
+
+def test_balance_jobs_never_duplicates_a_program_on_one_machine():
+    jobs = {"01": ["1000", "1001", "1002", "1003"], "02": ["1003"]}
+    balanced = balance_jobs(jobs, [make_machine(1), make_machine(2)])
+    for programs in balanced.values():
+        assert len(programs) == len(set(programs))
+    assert sorted(sum(balanced.values(), [])) == sorted(sum(jobs.values(), []))
+
+
+def test_get_machine_loads_reports_moves_and_files():
+    jobs = {"01": pg_ids(200)}
+    balanced = balance_jobs(jobs, [make_machine(1), make_machine(2)])
+    loads = {load.machine: load for load in get_machine_loads(balanced, jobs)}
+    assert (loads["01"].program_count, loads["01"].file_count, loads["01"].moved_out) == (100, 2, 100)
+    assert (loads["02"].program_count, loads["02"].moved_in) == (100, 100)
+    assert "Machine 01: 100 programs in 2 separate files" in format_load_report(list(loads.values()))